@@ -1,5 +1,10 @@
+import asyncio
 import datetime
-from typing import Optional
+import hashlib
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, AsyncIterator, Callable, TypeVar
 
 import aiosqlite
 import prometheus_client
@@ -7,20 +12,46 @@ from aiosqlite import Connection
 
 from fa_journaliser.prom import get_prometheus_port
 
+DATABASE_FILE = "journals.db"
+ENTRY_METRIC_FLUSH_SIZE = 100
+WRITE_BATCH_SIZE = 500
+MAX_SQL_VARIABLES = 999
+UPSERT_SQL = (
+    "INSERT INTO journals (journal_id, is_deleted, archive_datetime, error, login_used, json) "
+    "VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(journal_id) DO UPDATE SET "
+    "is_deleted = excluded.is_deleted, error = excluded.error, login_used = excluded.login_used, json = excluded.json"
+)
+
 total_journal_db_entries = prometheus_client.Gauge(
     "fajournaliser_database_journal_entries_total",
     "Total number of journal entries in the database",
 )
 
+T = TypeVar("T")
+JournalRow = tuple[int, bool, datetime.datetime, Optional[str], Optional[str], Optional[str]]
+
 
 class Database:
 
     def __init__(self) -> None:
         self.db: Optional[Connection] = None
+        self._writer_executor: Optional[ThreadPoolExecutor] = None
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._pending_entry_count = 0
+        self._write_queue: Optional[asyncio.Queue[tuple[list[JournalRow], asyncio.Future]]] = None
+        self._writer_task: Optional[asyncio.Task] = None
 
     async def start(self) -> None:
-        self.db = await aiosqlite.connect("journals.db")
+        self.db = await aiosqlite.connect(DATABASE_FILE)
         self.db.row_factory = aiosqlite.Row
+        # WAL mode lets readers carry on during writes, and NORMAL sync avoids an fsync on every commit
+        await self.db.execute("PRAGMA journal_mode=WAL")
+        await self.db.execute("PRAGMA synchronous=NORMAL")
+        await self.db.execute("PRAGMA temp_store=MEMORY")
+        await self.db.execute("PRAGMA cache_size=-64000")
+        await self.db.execute("PRAGMA mmap_size=268435456")
+        await self.db.execute("PRAGMA busy_timeout=5000")
         await self.db.execute("""CREATE TABLE IF NOT EXISTS `journals` (
             `journal_id` INT NOT NULL,
             `is_deleted` BOOLEAN NOT NULL,
@@ -30,6 +61,9 @@ class Database:
             `json` TEXT,
             PRIMARY KEY (`journal_id`)
         );""")
+        await self.db.execute(
+            "CREATE INDEX IF NOT EXISTS `idx_journals_noerror` ON `journals` (`journal_id`) WHERE `error` IS NULL"
+        )
         await self.db.commit()
         # If we're not using prometheus, speed up startup by skipping row count
         if get_prometheus_port() is not None:
@@ -37,13 +71,36 @@ class Database:
             total_journal_db_entries.set(entry_count)
 
     async def stop(self) -> None:
+        self._flush_entry_count()
         if self.db is not None:
             await self.db.close()
+        if self._writer_executor is not None:
+            await self._run_on_writer(self._close_writer_connection)
+            self._writer_executor.shutdown()
+            self._writer_executor = None
+
+    async def _run_on_writer(self, func: Callable[..., T], *args) -> T:
+        if self._writer_executor is None:
+            # All journal entry writes go through one thread and one connection, so they never fight over the lock
+            self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal-writer")
+        return await asyncio.get_running_loop().run_in_executor(self._writer_executor, func, *args)
+
+    def _writer_connection(self) -> sqlite3.Connection:
+        if self._writer_conn is None:
+            # Autocommit mode, transactions are managed explicitly by the bulk methods
+            self._writer_conn = sqlite3.connect(DATABASE_FILE, isolation_level=None)
+            self._writer_conn.execute("PRAGMA synchronous=NORMAL")
+            self._writer_conn.execute("PRAGMA busy_timeout=5000")
+        return self._writer_conn
+
+    def _close_writer_connection(self) -> None:
+        if self._writer_conn is not None:
+            self._writer_conn.close()
+            self._writer_conn = None
 
     async def count_journals(self) -> int:
-        async with self.db.execute("SELECT COUNT(*) AS count FROM journals") as cursor:
-            async for row in cursor:
-                count = row['count']
+        async with self.db.execute("SELECT COUNT(*) FROM journals") as cursor:
+            (count,) = await cursor.fetchone()
         return count
 
     async def add_entry(
@@ -55,18 +112,91 @@ class Database:
             login_used: Optional[str],
             json_data: Optional[str],
     ) -> None:
-        await self.db.execute(
-            "INSERT INTO journals (journal_id, is_deleted, archive_datetime, error, login_used, json) "
-            "VALUES (?, ?, ?, ?, ?, ?) "
-            "ON CONFLICT(journal_id) DO UPDATE SET "
-            "is_deleted = ?, error = ?, login_used = ?, json = ?",
-            (
-                journal_id, is_deleted, archive_date, error, login_used, json_data,
-                is_deleted, error, login_used, json_data
-            )
-        )
-        await self.db.commit()
-        total_journal_db_entries.inc(1)
+        await self.add_entries([(journal_id, is_deleted, archive_date, error, login_used, json_data)])
+
+    def _flush_entry_count(self) -> None:
+        if self._pending_entry_count:
+            total_journal_db_entries.inc(self._pending_entry_count)
+            self._pending_entry_count = 0
+
+    async def add_entries(self, rows: list[JournalRow]) -> None:
+        if not rows:
+            return
+        # The writer task might have been cancelled along with the event loop of a previous command
+        if self._writer_task is None or self._writer_task.done():
+            self._write_queue = asyncio.Queue()
+            self._writer_task = asyncio.create_task(self._run_writer())
+        written = asyncio.get_running_loop().create_future()
+        await self._write_queue.put((rows, written))
+        await written
+
+    async def _run_writer(self) -> None:
+        """
+        Single writer for journal entries, which combines all the writes which are queued up into one transaction. This
+        means concurrent savers are not fighting over the write lock, or committing separately.
+        """
+        while True:
+            batch = [await self._write_queue.get()]
+            num_rows = len(batch[0][0])
+            while not self._write_queue.empty() and num_rows < WRITE_BATCH_SIZE:
+                batch.append(self._write_queue.get_nowait())
+                num_rows += len(batch[-1][0])
+            rows = [row for batch_rows, _ in batch for row in batch_rows]
+            try:
+                # Run the whole batch in one writer thread call, rather than hopping to aiosqlite's thread per statement
+                new_count = await self._run_on_writer(self.bulk_upsert_sync, rows)
+            except Exception as e:
+                if len(batch) == 1:
+                    if not batch[0][1].done():
+                        batch[0][1].set_exception(e)
+                    continue
+                # The combined transaction was rolled back, so retry each caller alone, and only fail the bad ones
+                new_count = await self._write_separately(batch)
+            else:
+                for _, written in batch:
+                    if not written.done():
+                        written.set_result(None)
+            # Update the entry count metric in chunks when busy, but keep it current when idle
+            self._pending_entry_count += new_count
+            if self._pending_entry_count >= ENTRY_METRIC_FLUSH_SIZE or self._write_queue.empty():
+                self._flush_entry_count()
+
+    async def _write_separately(self, batch: list[tuple[list[JournalRow], asyncio.Future]]) -> int:
+        new_count = 0
+        for rows, written in batch:
+            try:
+                new_count += await self._run_on_writer(self.bulk_upsert_sync, rows)
+            except Exception as e:
+                if not written.done():
+                    written.set_exception(e)
+                continue
+            if not written.done():
+                written.set_result(None)
+        return new_count
+
+    def bulk_upsert_sync(self, rows: list[JournalRow]) -> int:
+        """
+        Upserts a batch of journal entries in a single transaction, on the writer connection. This must be run on the
+        writer thread. Returns the number of entries which were not already in the database.
+        """
+        conn = self._writer_connection()
+        journal_ids = sorted(set(row[0] for row in rows))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Count in chunks, as older sqlite versions only allow 999 bound variables in a statement
+            existing_count = 0
+            for start in range(0, len(journal_ids), MAX_SQL_VARIABLES):
+                chunk_ids = journal_ids[start:start + MAX_SQL_VARIABLES]
+                existing_count += conn.execute(
+                    f"SELECT COUNT(*) FROM journals WHERE journal_id IN ({', '.join('?' * len(chunk_ids))})",
+                    chunk_ids,
+                ).fetchone()[0]
+            conn.executemany(UPSERT_SQL, rows)
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return len(journal_ids) - existing_count
 
     async def update_entry(
             self,
@@ -77,32 +207,68 @@ class Database:
             login_used: Optional[str],
             json_data: Optional[str],
     ) -> None:
-        await self.db.execute(
+        await self._run_on_writer(
+            self._update_sync,
+            (is_deleted, archive_date, error, login_used, json_data, journal_id),
+        )
+
+    def _update_sync(self, params: tuple) -> None:
+        # The writer connection is in autocommit mode, so this single statement commits by itself
+        self._writer_connection().execute(
             "UPDATE journals SET "
-            "is_deleted = ? AND archive_datetime = ? AND error = ? AND login_used = ? AND json = ? "
+            "is_deleted = ?, archive_datetime = ?, error = ?, login_used = ?, json = ? "
             "WHERE journal_id = ?",
-            (
-                is_deleted, archive_date, error, login_used, json_data, journal_id
-            )
+            params,
         )
-        await self.db.commit()
 
-    async def list_journal_ids_truncated(self, min_id: int, max_id: Optional[int]) -> list[int]:
-        journal_ids = []
+    async def stream_journal_id_gaps(self, min_id: int, max_id: Optional[int]) -> AsyncIterator[tuple[int, int]]:
+        """
+        Yields the (first, last) journal IDs of each run of missing journal entries, between the lowest and highest
+        journal entries in the given range.
+        """
         async with self.db.execute(
-                "SELECT journal_id FROM journals WHERE journal_id >= ? AND (? IS NULL OR journal_id <= ?)",
+                "SELECT prev_id + 1, journal_id - 1 FROM ("
+                "SELECT journal_id, LAG(journal_id) OVER (ORDER BY journal_id) AS prev_id FROM journals "
+                "WHERE journal_id >= ? AND (? IS NULL OR journal_id <= ?)"
+                ") WHERE journal_id - prev_id > 1",
                 (min_id, max_id, max_id)
         ) as cursor:
             async for row in cursor:
-                journal_ids.append(row['journal_id'])
-        return journal_ids
+                yield row[0], row[1]
 
-    async def list_ids_where_path_is_null(self, json_path: str) -> list[int]:
-        journal_ids = []
+    async def journal_id_range(self, min_id: int, max_id: Optional[int]) -> tuple[Optional[int], Optional[int]]:
         async with self.db.execute(
-                "SELECT journal_id FROM journals WHERE error IS NULL AND json_extract(json, ?) IS NULL",
-                (json_path,)
+                "SELECT MIN(journal_id) AS lowest, MAX(journal_id) AS highest FROM journals "
+                "WHERE journal_id >= ? AND (? IS NULL OR journal_id <= ?)",
+                (min_id, max_id, max_id)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return row['lowest'], row['highest']
+
+    async def create_json_path_index(self, json_path: str) -> None:
+        """
+        Creates a partial expression index for the given json path, if one does not already exist. This is only done
+        when explicitly asked for, as the index is kept permanently, and every later insert or update of a journal entry
+        has to maintain it.
+        """
+        # Paths which differ only in punctuation would get the same readable name, so add a hash of the exact path
+        path_hash = hashlib.sha1(json_path.encode()).hexdigest()[:8]
+        index_name = "idx_json_extract_" + re.sub(r"[^a-zA-Z0-9]+", "_", json_path).strip("_") + "_" + path_hash
+        path_expr = _json_path_expr(json_path)
+        await self.db.execute(
+            f"CREATE INDEX IF NOT EXISTS `{index_name}` ON `journals` ({path_expr}) WHERE `error` IS NULL"
+        )
+        await self.db.commit()
+
+    async def stream_ids_where_path_is_null(self, json_path: str) -> AsyncIterator[int]:
+        # This matches the expression of any index made by create_json_path_index, so sqlite can use it if it exists
+        async with self.db.execute(
+                f"SELECT journal_id FROM journals WHERE error IS NULL AND {_json_path_expr(json_path)} IS NULL",
         ) as cursor:
             async for row in cursor:
-                journal_ids.append(row['journal_id'])
-        return journal_ids
+                yield row[0]
+
+
+def _json_path_expr(json_path: str) -> str:
+    # Expression indexes cannot use bound parameters, so the path has to be quoted into the SQL
+    return "json_extract(json, '" + json_path.replace("'", "''") + "')"
@@ -1,19 +1,20 @@
 import asyncio
 import datetime
+import itertools
 import json
 import os
 import logging
-from typing import Optional
+import random
+from types import TracebackType
+from typing import Optional, Type, Sequence
 
-import aiofiles
-import aiofiles.os
 import aiohttp
 import prometheus_client
 
 from fa_journaliser.database import Database
 from fa_journaliser.journal import Journal
 from fa_journaliser.journal_info import JournalInfo
-from fa_journaliser.utils import split_list, total_journal_files, list_journals_truncated, _peak_time_active
+from fa_journaliser.utils import total_journal_files, _peak_time_active, list_downloaded_journal_ids_in_dirs
 
 logger = logging.getLogger(__name__)
 
@@ -21,9 +22,22 @@ BATCH_SIZE = 5
 PEAK_SLEEP = 60
 EMPTY_BATCH_SLEEP = 300
 PEAK_REGISTERED_CUTOFF = 10_000
+MAX_CONCURRENT_DOWNLOADS = 8
+FILL_GAPS_WINDOW = 256
+PRIVATE_RATIO_SMOOTHING = 0.05
+LOGIN_FIRST_EXPLORE_RATE = 0.1
+MAX_RETRY_SLEEP = 30
+MAX_RETRY_AFTER = 120
+DOWNLOAD_CHUNK_SIZE = 65536
+# Only socket level timeouts are set, as those raise ClientError subclasses which are retried
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60)
 USER_AGENT = "FA-Journaliser/1.0.0 (https://github.com/Deer-Spangle/fa-journaliser contact: fa-journals@spangle.org.uk)"
 
 
+class DownloadFailed(Exception):
+    pass
+
+
 total_web_requests = prometheus_client.Counter(
     "fajournaliser_web_request_total",
     "Total number of web requests which were made",
@@ -34,6 +48,10 @@ web_request_timing_histogram = prometheus_client.Histogram(
     "Histogram of the time taken by each complete web request, from request to content complete. In seconds.",
     buckets=[0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 5, 10],
 )
+web_requests_in_progress = prometheus_client.Gauge(
+    "fajournaliser_web_requests_in_progress",
+    "Number of web requests to FA which are currently in flight",
+)
 total_downloaded_bytes = prometheus_client.Counter(
     "fajournaliser_total_downloaded_bytes",
     "Total amount of bytes downloaded from FA",
@@ -48,7 +66,7 @@ download_attempts_needed = prometheus_client.Histogram(
     "fajournaliser_download_attempts_needed_total",
     "Number of web requests needed to successfully download a page",
     labelnames=["has_cookies"],
-    buckets=[1, 2, 3, 4, 5],
+    buckets=[1, 2, 3, 4, 5, 8, 16],
 )
 total_downloaded_journals = prometheus_client.Counter(
     "fajournaliser_downloaded_journals_total",
@@ -57,13 +75,14 @@ total_downloaded_journals = prometheus_client.Counter(
 )
 batch_download_timing_histogram = prometheus_client.Histogram(
     "fajournaliser_batch_download_time_taken_seconds",
-    "Histogram of the time taken per batch of downloads, in seconds.",
+    "Histogram of the time taken per batch of downloads, in seconds. Labelled by batch size class (small is up to 8, "
+    "medium up to 32)",
     labelnames=["batch_size"],
     buckets=[0.1, 0.5, 1, 1.5, 2, 3, 4, 5, 10],
 )
 batch_save_timing_histogram = prometheus_client.Histogram(
     "fajournaliser_batch_save_time_taken_seconds",
-    "Histogram of the time taken to save a batch of journal entries, in seconds.",
+    "Histogram of the time taken to save a batch of journal entries, in seconds. Labelled by batch size class",
     labelnames=["batch_size"],
     buckets=[0.1, 0.5, 1, 1.5, 2, 3, 4, 5, 10],
 )
@@ -104,143 +123,396 @@ peak_time_metric = prometheus_client.Gauge(
     "fajournaliser_peak_time_active",
     "Whether peak time is currently active, boolean. Whether there are more than 10k registered users online",
 )
+private_journal_ratio = prometheus_client.Gauge(
+    "fajournaliser_private_journal_ratio",
+    "Moving average of the proportion of recently downloaded journals which needed a login to view",
+)
+download_failures = prometheus_client.Counter(
+    "fajournaliser_download_failures_total",
+    "Total number of journal downloads which were given up on, by whether the error could have been retried",
+    labelnames=["retryable"],
+)
+# Bind the labelled metrics up front, so the download path doesn't look up labels on every request
+web_requests_by_login = {login: total_web_requests.labels(has_cookies=str(login)) for login in [True, False]}
+attempts_needed_by_login = {login: download_attempts_needed.labels(has_cookies=str(login)) for login in [True, False]}
+downloaded_pages_by_login = {login: total_downloaded_pages.labels(has_cookies=str(login)) for login in [True, False]}
+downloaded_bytes_by_login = {login: total_downloaded_bytes.labels(has_cookies=str(login)) for login in [True, False]}
+downloaded_journals_by_login = {
+    login: total_downloaded_journals.labels(needed_login=str(login)) for login in [True, False]
+}
+# Journals downloaded with the login straight away can't tell whether they needed it
+downloaded_journals_login_first = total_downloaded_journals.labels(needed_login="Unknown")
+download_failures_by_retryable = {
+    retryable: download_failures.labels(retryable=str(retryable)) for retryable in [True, False]
+}
+
+
+def _batch_size_class(batch_size: int) -> str:
+    # Work forwards adapts its batch size, so group sizes into a few classes to keep the label cardinality low
+    if batch_size <= 8:
+        return "small"
+    if batch_size <= 32:
+        return "medium"
+    return "large"
+
+
+# Bind the batch timers for each size class up front, as with the other labelled metrics
+batch_download_timers = {
+    size_class: batch_download_timing_histogram.labels(batch_size=size_class)
+    for size_class in ["small", "medium", "large"]
+}
+batch_save_timers = {
+    size_class: batch_save_timing_histogram.labels(batch_size=size_class)
+    for size_class in ["small", "medium", "large"]
+}
+
+
+def _is_retryable(error: aiohttp.ClientError) -> bool:
+    # Client errors are not going to change if we ask again, except for rate limiting
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+    return True
+
+
+def _retry_after(error: aiohttp.ClientError) -> Optional[float]:
+    # Only the delay-seconds form of Retry-After is handled, the HTTP date form falls back to normal backoff
+    if not isinstance(error, aiohttp.ClientResponseError) or error.headers is None:
+        return None
+    retry_after = error.headers.get("Retry-After")
+    if retry_after is None or not retry_after.strip().isdigit():
+        return None
+    # Don't let one bad or hostile header stall this download, and every other one waiting on it, indefinitely
+    return min(float(retry_after), MAX_RETRY_AFTER)
+
+
+class Downloader:
+    """
+    Holds the long-lived web sessions used for downloading journals, so that connections can be kept alive and reused
+    between requests. One session is anonymous, and the other uses the backup login cookies.
+    """
+
+    def __init__(
+            self,
+            backup_cookies: dict,
+            max_concurrent_downloads: int = MAX_CONCURRENT_DOWNLOADS,
+            max_retries: Optional[int] = None,
+            login_first_ratio: Optional[float] = None,
+    ) -> None:
+        self.backup_cookies = backup_cookies
+        # If set, download with the login straight away while this proportion of recent journals have been private
+        self.login_first_ratio = login_first_ratio
+        self.private_ratio = 0.0
+        # If not set, keep retrying failed downloads forever, so the archiver can ride out site outages
+        self.max_retries = max_retries
+        self.semaphore = asyncio.BoundedSemaphore(max_concurrent_downloads)
+        # Cleared while web requests are failing, so that only the failing downloads keep probing the site
+        self.site_up = asyncio.Event()
+        self.site_up.set()
+        self.connector: Optional[aiohttp.TCPConnector] = None
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.login_session: Optional[aiohttp.ClientSession] = None
+
+    async def start(self) -> None:
+        self.connector = aiohttp.TCPConnector(limit=64, limit_per_host=16, ttl_dns_cache=300, keepalive_timeout=75)
+        headers = {"User-Agent": USER_AGENT}
+        self.session = aiohttp.ClientSession(
+            connector=self.connector,
+            connector_owner=False,
+            headers=headers,
+            timeout=REQUEST_TIMEOUT,
+        )
+        self.login_session = aiohttp.ClientSession(
+            connector=self.connector,
+            connector_owner=False,
+            cookies=self.backup_cookies,
+            headers=headers,
+            timeout=REQUEST_TIMEOUT,
+        )
+
+    async def stop(self) -> None:
+        for session in [self.session, self.login_session]:
+            if session is not None:
+                await session.close()
+        if self.connector is not None:
+            await self.connector.close()
+
+    async def __aenter__(self) -> "Downloader":
+        await self.start()
+        return self
+
+    async def __aexit__(
+            self,
+            exc_type: Optional[Type[BaseException]],
+            exc_val: Optional[BaseException],
+            exc_tb: Optional[TracebackType],
+    ) -> None:
+        await self.stop()
 
+    def use_login_first(self) -> bool:
+        if self.login_first_ratio is None or self.private_ratio < self.login_first_ratio:
+            return False
+        # Occasionally check without the login anyway, so that the ratio can still fall
+        return random.random() >= LOGIN_FIRST_EXPLORE_RATE
 
-async def download_journal(journal_id: int, cookies: Optional[dict] = None) -> Journal:
+    def record_private(self, account_private: bool) -> None:
+        self.private_ratio += PRIVATE_RATIO_SMOOTHING * (int(account_private) - self.private_ratio)
+        private_journal_ratio.set(self.private_ratio)
+
+
+# Directories in the store which are known to exist, so they do not need creating again
+_ensured_dirs: set[str] = set()
+
+
+def _ensure_dir(dirname: str) -> None:
+    if dirname not in _ensured_dirs:
+        os.makedirs(dirname, exist_ok=True)
+        _ensured_dirs.add(dirname)
+
+
+def _expected_length(resp: aiohttp.ClientResponse) -> int:
+    # Content-Length is the size before decompression, so it's only the body size if there is no content encoding
+    if resp.content_length is None or resp.headers.get("Content-Encoding", "identity") != "identity":
+        return 0
+    return resp.content_length
+
+
+def _write_file_sync(path: str | os.PathLike, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _stop_probing(downloader: Downloader, failures: int) -> None:
+    # A download which has failed may be the one the others are waiting on, so if it gives up, let them try again
+    if failures:
+        downloader.site_up.set()
+
+
+async def download_journal(downloader: Downloader, journal_id: int, use_login: bool = False) -> Journal:
     # Prepare directory
-    journal = Journal(journal_id, datetime.datetime.now())
+    journal = Journal(journal_id)
     filename = journal.journal_html_filename
-    dirname = os.path.dirname(filename)
-    await aiofiles.os.makedirs(dirname, exist_ok=True)
+    _ensure_dir(os.path.dirname(filename))
     # Setup metrics
     req_count = 0
-    cookie_label = str(cookies is not None)
+    failures = 0
+    session = downloader.login_session if use_login else downloader.session
     # Keep trying to make the web request until it works
-    while True:
-        session = aiohttp.ClientSession(cookies=cookies, headers={"User-Agent": USER_AGENT})
-        journal._archive_date = datetime.datetime.now()
-        try:
-            with web_request_timing_histogram.time():
-                async with session.get(journal.journal_link) as resp:
-                    req_count += 1
-                    total_web_requests.labels(has_cookies=cookie_label).inc()
-                    # Check web request worked
-                    resp.raise_for_status()
-                    # Download content
-                    content = b""
-                    async with aiofiles.open(filename, "wb") as f:
-                        async for chunk in resp.content.iter_chunked(8192):
-                            content += chunk
-                            await f.write(chunk)
-                    journal._info = JournalInfo.from_content_bytes(journal_id, content)
-        except aiohttp.ClientError as e:
-            logger.warning("Web request failed for journal %s, retrying", journal.journal_link, exc_info=e)
-            await asyncio.sleep(5)
-            continue
-        # Metrics
-        download_attempts_needed.labels(has_cookies=cookie_label).observe(req_count)
-        total_downloaded_pages.labels(has_cookies=cookie_label).inc()
-        total_downloaded_bytes.labels(has_cookies=cookie_label).inc(len(content))
-        # Return the journal
-        return journal
+    try:
+        while True:
+            # If other downloads are failing, wait for them to see the site come back, rather than piling on
+            if failures == 0:
+                await downloader.site_up.wait()
+            try:
+                async with downloader.semaphore:
+                    with web_requests_in_progress.track_inprogress(), web_request_timing_histogram.time():
+                        async with session.get(journal.journal_link) as resp:
+                            req_count += 1
+                            web_requests_by_login[use_login].inc()
+                            # Check web request worked
+                            resp.raise_for_status()
+                            # Download content, into a buffer sized up front where the length is known
+                            content = bytearray(_expected_length(resp))
+                            offset = 0
+                            async for chunk in resp.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                                content[offset:offset + len(chunk)] = chunk
+                                offset += len(chunk)
+                            del content[offset:]
+            except aiohttp.ClientError as e:
+                if not _is_retryable(e):
+                    download_failures_by_retryable[False].inc()
+                    raise DownloadFailed(f"Web request for journal {journal.journal_link} failed: {e}") from e
+                if downloader.max_retries is not None and failures >= downloader.max_retries:
+                    download_failures_by_retryable[True].inc()
+                    raise DownloadFailed(
+                        f"Web request for journal {journal.journal_link} failed after {failures + 1} attempts: {e}"
+                    ) from e
+                downloader.site_up.clear()
+                retry_sleep = min(MAX_RETRY_SLEEP, 0.5 * 2 ** failures) * (1 + random.random() * 0.5)
+                # If the site says how long to back off for, wait at least that long
+                retry_after = _retry_after(e)
+                if retry_after is not None:
+                    retry_sleep = max(retry_sleep, retry_after)
+                failures += 1
+                logger.warning(
+                    "Web request failed for journal %s, retrying in %.1fs",
+                    journal.journal_link,
+                    retry_sleep,
+                    exc_info=e,
+                )
+                await asyncio.sleep(retry_sleep)
+                continue
+            break
+    finally:
+        # However this stops retrying, even if cancelled mid-request, don't leave other downloads waiting on it
+        _stop_probing(downloader, failures)
+    downloader.site_up.set()
+    # Only take the archive date from the attempt which worked
+    journal._archive_date = datetime.datetime.now()
+    # Write the page to disk and parse it in worker threads at the same time, so other downloads can carry on
+    _, journal._info = await asyncio.gather(
+        asyncio.to_thread(_write_file_sync, filename, content),
+        asyncio.to_thread(JournalInfo.from_content_bytes, journal_id, bytes(content)),
+    )
+    # Metrics
+    attempts_needed_by_login[use_login].observe(req_count)
+    downloaded_pages_by_login[use_login].inc()
+    downloaded_bytes_by_login[use_login].inc(len(content))
+    # Return the journal
+    return journal
 
 
-async def download_journal_with_backup_cookies(journal_id: int, cookies: dict) -> Journal:
-    journal = await download_journal(journal_id)
+async def download_journal_with_backup_cookies(downloader: Downloader, journal_id: int) -> Journal:
+    if downloader.use_login_first():
+        journal = await download_journal(downloader, journal_id, use_login=True)
+        downloaded_journals_login_first.inc()
+        total_journal_files.inc()
+        return journal
+    journal = await download_journal(downloader, journal_id)
     info = await journal.info()
+    downloader.record_private(info.account_private)
+    # Only download again with the login if the page needs it
     if info.account_private:
-        journal = await download_journal(journal_id, cookies)
-    total_downloaded_journals.labels(needed_login=str(info.account_private)).inc()
+        journal = await download_journal(downloader, journal_id, use_login=True)
+    downloaded_journals_by_login[info.account_private].inc()
     total_journal_files.inc()
     return journal
 
 
-async def download_and_save(db: Database, journal_id: int, cookies: dict) -> Journal:
-    journal = await download_journal_with_backup_cookies(journal_id, cookies)
+async def download_and_save(db: Database, downloader: Downloader, journal_id: int) -> Journal:
+    journal = await download_journal_with_backup_cookies(downloader, journal_id)
     await journal.save(db)
     return journal
 
 
-async def download_if_not_exists(db: Database, journal_id: int, cookies: dict) -> Journal:
+async def download_if_not_exists(db: Database, downloader: Downloader, journal_id: int) -> Journal:
     journal = Journal(journal_id)
     if await journal.is_downloaded():
         return journal
-    return await download_and_save(db, journal_id, cookies)
+    return await download_and_save(db, downloader, journal_id)
+
+
+async def _download_or_skip(downloader: Downloader, journal_id: int) -> Optional[Journal]:
+    try:
+        return await download_journal_with_backup_cookies(downloader, journal_id)
+    except DownloadFailed as e:
+        # Leave a gap rather than stopping the whole batch, fill_gaps can try this journal again later
+        logger.warning("Skipping journal %s, as the download failed: %s", journal_id, e)
+        return None
 
 
-async def download_many(journal_ids: list[int], cookies: dict) -> list[Journal]:
-    with batch_download_timing_histogram.labels(batch_size=str(len(journal_ids))).time():
-        return list(await asyncio.gather(*[
-            download_journal_with_backup_cookies(journal_id, cookies) for journal_id in journal_ids
-        ]))
+async def _download_start_journal(db: Database, downloader: Downloader, journal_id: int) -> Journal:
+    try:
+        return await download_if_not_exists(db, downloader, journal_id)
+    except DownloadFailed as e:
+        logger.warning("Could not download start journal %s, working from it anyway: %s", journal_id, e)
+        return Journal(journal_id)
+
+
+async def download_many(downloader: Downloader, journal_ids: Sequence[int]) -> list[tuple[Journal, JournalInfo]]:
+    """
+    Downloads a batch of journals, returning the journals which could be downloaded, in ID order, along with their
+    parsed info. Any journals which failed to download are logged and left out.
+    """
+    with batch_download_timers[_batch_size_class(len(journal_ids))].time():
+        journals = await asyncio.gather(*[
+            _download_or_skip(downloader, journal_id) for journal_id in journal_ids
+        ])
+    # Pages are parsed as they are downloaded, so the info is already available
+    return [(journal, journal._info) for journal in journals if journal is not None]
 
 
 async def save_many(journals: list[Journal], db: Database) -> None:
-    with batch_save_timing_histogram.labels(batch_size=str(len(journals))).time():
-        await asyncio.gather(*[journal.save(db) for journal in journals])
+    with batch_save_timers[_batch_size_class(len(journals))].time():
+        rows = await asyncio.gather(*[journal.db_row() for journal in journals])
+        await db.add_entries(rows)
+
+
+def _bulk_unlink(paths: list[str | os.PathLike]) -> int:
+    deleted = 0
+    for path in paths:
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        deleted += 1
+    return deleted
 
 
 async def delete_many(journals: list[Journal]) -> None:
-    await asyncio.gather(*[aiofiles.os.remove(j.journal_html_filename) for j in journals])
-    total_journal_files.inc(-len(journals))
+    # Delete all the files in one worker thread, rather than a thread hop per file
+    deleted = await asyncio.to_thread(_bulk_unlink, [j.journal_html_filename for j in journals])
+    total_journal_files.inc(-deleted)
 
 
 async def work_forwards(
         db: Database,
+        downloader: Downloader,
         start_journal: Journal,
-        backup_cookies: dict,
         max_id: Optional[int] = None,
         batch_size: int = BATCH_SIZE,
         peak_sleep: int = PEAK_SLEEP,
         empty_batch_sleep: int = EMPTY_BATCH_SLEEP,
         peak_users_cutoff: int = PEAK_REGISTERED_CUTOFF,
 ) -> None:
-    work_forwards_batch_size.set(batch_size)
     logger.info("Working forwards from %s, this is tricky.", start_journal)
     last_good_id = start_journal.journal_id
     peak_hours_active = True
+    # Batch size adapts to how many new journals there are, but never goes above the given size
+    max_batch_size = batch_size
+    consecutive_empty_batches = 0
     while True:
+        work_forwards_batch_size.set(batch_size)
         await asyncio.sleep(2)
         # Figure out next batch of IDs to try
         batch_start = last_good_id + 1
         batch_end = last_good_id + batch_size + 1
         if max_id is not None:
             batch_end = min(batch_end, max_id)
-        next_batch = list(range(batch_start, batch_end))
+        next_batch = range(batch_start, batch_end)
         # If batch is empty, we're done
         if not next_batch:
             logger.info("Working forwards complete, reached the maximum journal ID, wow!")
             return
         # Download the next batch
-        logger.info("Attempting to download new journals %s", next_batch)
-        next_journals = await download_many(next_batch, backup_cookies)
+        logger.info("Attempting to download new journals %s to %s", next_batch.start, next_batch.stop - 1)
+        downloaded = await download_many(downloader, next_batch)
+        next_journals = [journal for journal, _ in downloaded]
+        next_infos = [info for _, info in downloaded]
         # Figure out which ones exist
-        next_infos = list(await asyncio.gather(*[j.info() for j in next_journals]))
-        good_journals = [next_journals[i] for i, info in enumerate(next_infos) if not info.journal_deleted]
+        good_journals = [journal for journal, info in downloaded if not info.journal_deleted]
         # If none of these journals exist, then wait and try again
         if len(good_journals) == 0:
             work_forwards_empty_batch_count.inc()
+            # Check less of the future, and back off checking, while no new journals are appearing
+            batch_size = max(1, batch_size // 2)
+            retry_sleep = min(empty_batch_sleep, 2 * 2 ** consecutive_empty_batches)
+            consecutive_empty_batches += 1
             logger.warning(
                 "Didn't get any good new journals in that batch! Gonna wait %ss and retry",
-                empty_batch_sleep,
+                retry_sleep,
             )
             await delete_many(next_journals)
-            await asyncio.sleep(empty_batch_sleep)
+            await asyncio.sleep(retry_sleep)
             continue
+        consecutive_empty_batches = 0
         # Convert to list of IDs and figure which is the bleeding edge newest journal
         good_ids = [j.journal_id for j in good_journals]
         last_good_id = max(good_ids)
         work_forwards_last_good_id.set(last_good_id)
         # Figure out which were before the bleeding edge and which are after, save the ones which should exist
-        split_on_last_good = split_list(next_journals, lambda j: j.journal_id <= last_good_id)
+        saved_journals = [j for j in next_journals if j.journal_id <= last_good_id]
+        wasted_journals = [j for j in next_journals if j.journal_id > last_good_id]
         await asyncio.gather(
-            save_many(split_on_last_good[True], db),
-            delete_many(split_on_last_good[False])
+            save_many(saved_journals, db),
+            delete_many(wasted_journals)
         )
         # Metrics and logging
-        work_forwards_total_new_journals.inc(len(split_on_last_good[True]))
-        work_forwards_wasted_downloads.inc(len(split_on_last_good[False]))
-        saved_ids = [j.journal_id for j in split_on_last_good[True]]
+        work_forwards_total_new_journals.inc(len(saved_journals))
+        work_forwards_wasted_downloads.inc(len(wasted_journals))
+        # If the whole batch was used, there's likely more to catch up on, so grab more next time
+        if not wasted_journals:
+            batch_size = min(max_batch_size, batch_size * 2)
+        saved_ids = [j.journal_id for j in saved_journals]
         logger.info("Downloaded new journals: (%s) %s", len(saved_ids), saved_ids)
         # Check if it is peak hours
         peak_time_active = _peak_time_active(peak_hours_active, next_infos, peak_users_cutoff)
@@ -252,8 +524,8 @@ async def work_forwards(
 
 async def work_backwards(
         db: Database,
+        downloader: Downloader,
         start_journal: Journal,
-        backup_cookies: dict,
         min_id: int = 0,
         batch_size: int = BATCH_SIZE,
         peak_sleep: int = PEAK_SLEEP,
@@ -264,38 +536,49 @@ async def work_backwards(
     current_journal = start_journal
     peak_time_active = True
     peak_time_metric.set(peak_time_active)
-    while True:
-        # Figure out next batch
-        batch_start = max(min_id, current_journal.journal_id - batch_size)
-        batch_end = current_journal.journal_id
-        next_batch = list(range(batch_start, batch_end))
-        # If batch is empty, we're done
-        if len(next_batch) == 0:
-            logger.critical("Working backwards is complete! Wow")
-            return
-        # Download next batch
-        logger.info("Attempting to download old journal batch %s", next_batch)
-        next_journals = await download_many(next_batch, backup_cookies)
-        await save_many(next_journals, db)
-        logger.info("Downloaded old journals %s", next_batch)
-        # Figure out next ID to start from
-        current_journal = min(next_journals, key=lambda x: x.journal_id)
-        work_backwards_oldest_id.set(current_journal.journal_id)
-        next_infos = list(await asyncio.gather(*[j.info() for j in next_journals]))
-        good_ids = [i.journal_id for i in next_infos if not i.journal_deleted]
-        if good_ids:
-            work_backwards_oldest_good_id.set(min(good_ids))
-        # Figure out if peak time is active
-        peak_time_active = _peak_time_active(peak_time_active, next_infos, peak_users_cutoff)
-        peak_time_metric.set(int(peak_time_active))
-        if peak_time_active:
-            logger.info("Peak time active, sleeping %s seconds before next batch", peak_sleep)
-            await asyncio.sleep(peak_sleep)
+    save_task: Optional[asyncio.Task] = None
+    try:
+        while True:
+            # Figure out next batch
+            batch_start = max(min_id, current_journal.journal_id - batch_size)
+            batch_end = current_journal.journal_id
+            next_batch = range(batch_start, batch_end)
+            # If batch is empty, we're done
+            if not next_batch:
+                logger.critical("Working backwards is complete! Wow")
+                return
+            # Download next batch
+            logger.info("Attempting to download old journal batch %s to %s", next_batch.start, next_batch.stop - 1)
+            downloaded = await download_many(downloader, next_batch)
+            next_journals = [journal for journal, _ in downloaded]
+            next_infos = [info for _, info in downloaded]
+            # Save this batch while the next one downloads, only keeping one save in flight
+            if save_task is not None:
+                await save_task
+            save_task = asyncio.create_task(save_many(next_journals, db))
+            logger.info("Downloaded old journals %s to %s", next_batch.start, next_batch.stop - 1)
+            # Figure out next ID to start from
+            # Some journals may have failed to download, so go from the batch itself
+            current_journal = Journal(next_batch.start)
+            work_backwards_oldest_id.set(current_journal.journal_id)
+            good_ids = [i.journal_id for i in next_infos if not i.journal_deleted]
+            if good_ids:
+                work_backwards_oldest_good_id.set(min(good_ids))
+            # Figure out if peak time is active
+            peak_time_active = _peak_time_active(peak_time_active, next_infos, peak_users_cutoff)
+            peak_time_metric.set(int(peak_time_active))
+            if peak_time_active:
+                logger.info("Peak time active, sleeping %s seconds before next batch", peak_sleep)
+                await asyncio.sleep(peak_sleep)
+    finally:
+        # Don't leave the last save running unattended if downloading stops, so that batch is saved or its error seen
+        if save_task is not None:
+            await save_task
 
 
 async def run_download(
         db: Database,
-        backup_cookies: dict,
+        downloader: Downloader,
         start_id: Optional[int] = None,
         min_id: int = 0,
         max_id: Optional[int] = None,
@@ -306,49 +589,111 @@ async def run_download(
         forward_empty_batch_sleep: int = EMPTY_BATCH_SLEEP,
         peak_users_cutoff: int = PEAK_REGISTERED_CUTOFF,
 ) -> None:
-    # List relevant journals
-    all_journals = list_journals_truncated(min_id, max_id)
-    # If there are no journals yet, download the start one
-    if not all_journals:
-        # If start ID isn't set, try and get it from the range
-        if start_id is None:
-            if max_id is None:
-                start_id = min_id
+    async with downloader:
+        # Find the range of relevant journals
+        lowest_id, highest_id = await db.journal_id_range(min_id, max_id)
+        # If there are no journals yet, download the start one
+        if lowest_id is None:
+            # If start ID isn't set, try and get it from the range
+            if start_id is None:
+                if max_id is None:
+                    start_id = min_id
+                else:
+                    start_id = (min_id + max_id) // 2
             else:
-                start_id = (min_id + max_id) // 2
+                raise ValueError("Start ID or min and max ID, must be set")
+            # Download the initial journal
+            await _download_start_journal(db, downloader, start_id)
+            lowest_id = highest_id = start_id
+        # Find newest and oldest in the set
+        newest = Journal(highest_id)
+        oldest = Journal(lowest_id)
+        # Work forward and backwards
+        task_fwd = asyncio.create_task(work_forwards(
+            db,
+            downloader,
+            newest,
+            max_id,
+            batch_size=forward_batch_size,
+            peak_sleep=forward_peak_sleep,
+            empty_batch_sleep=forward_empty_batch_sleep,
+            peak_users_cutoff=peak_users_cutoff,
+        ))
+        task_bkd = asyncio.create_task(work_backwards(
+            db,
+            downloader,
+            oldest,
+            min_id,
+            batch_size=backward_batch_size,
+            peak_sleep=backward_peak_sleep,
+            peak_users_cutoff=peak_users_cutoff,
+        ))
+        await asyncio.gather(task_fwd, task_bkd)
+
+
+async def run_work_forwards(
+        db: Database,
+        downloader: Downloader,
+        start_id: int,
+        max_id: Optional[int] = None,
+        batch_size: int = BATCH_SIZE,
+        peak_sleep: int = PEAK_SLEEP,
+        empty_batch_sleep: int = EMPTY_BATCH_SLEEP,
+        peak_users_cutoff: int = PEAK_REGISTERED_CUTOFF,
+) -> None:
+    async with downloader:
+        # Get the start point of the relevant journals
+        _, highest_id = await db.journal_id_range(start_id, max_id)
+        if highest_id is None:
+            # Fetch start journal if none exists
+            journal = await _download_start_journal(db, downloader, start_id)
         else:
-            raise ValueError("Start ID or min and max ID, must be set")
-        # Download the initial journal
-        start_journal = await download_and_save(db, start_id, backup_cookies)
-        all_journals = [start_journal]
-    # Find newest and oldest in the set
-    newest = all_journals[-1]
-    oldest = all_journals[0]
-    # Work forward and backwards
-    task_fwd = asyncio.create_task(work_forwards(
-        db,
-        newest,
-        backup_cookies,
-        max_id,
-        batch_size=forward_batch_size,
-        peak_sleep=forward_peak_sleep,
-        empty_batch_sleep=forward_empty_batch_sleep,
-        peak_users_cutoff=peak_users_cutoff,
-    ))
-    task_bkd = asyncio.create_task(work_backwards(
-        db,
-        oldest,
-        backup_cookies,
-        min_id,
-        batch_size=backward_batch_size,
-        peak_sleep=backward_peak_sleep,
-        peak_users_cutoff=peak_users_cutoff,
-    ))
-    await asyncio.gather(task_fwd, task_bkd)
-
-
-async def test_download(journal_id: int, db: Database, cookies: dict) -> None:
-    journal = await download_journal_with_backup_cookies(journal_id, cookies)
+            journal = Journal(highest_id)
+        # Start working forwards
+        await work_forwards(
+            db,
+            downloader,
+            journal,
+            max_id=max_id,
+            batch_size=batch_size,
+            peak_sleep=peak_sleep,
+            empty_batch_sleep=empty_batch_sleep,
+            peak_users_cutoff=peak_users_cutoff,
+        )
+
+
+async def run_work_backwards(
+        db: Database,
+        downloader: Downloader,
+        start_id: int,
+        min_id: int = 0,
+        batch_size: int = BATCH_SIZE,
+        peak_sleep: int = PEAK_SLEEP,
+        peak_users_cutoff: int = PEAK_REGISTERED_CUTOFF,
+) -> None:
+    async with downloader:
+        # Get the start point of the relevant journals
+        lowest_id, _ = await db.journal_id_range(min_id, start_id)
+        if lowest_id is None:
+            # Fetch start journal if none exists
+            journal = await _download_start_journal(db, downloader, start_id)
+        else:
+            journal = Journal(lowest_id)
+        # Start working backwards
+        await work_backwards(
+            db,
+            downloader,
+            journal,
+            min_id=min_id,
+            batch_size=batch_size,
+            peak_sleep=peak_sleep,
+            peak_users_cutoff=peak_users_cutoff,
+        )
+
+
+async def test_download(journal_id: int, db: Database, downloader: Downloader) -> None:
+    async with downloader:
+        journal = await download_journal_with_backup_cookies(downloader, journal_id)
     info = await journal.info()
     print(f"Page title: {info.page_title}")
     print(f"System error: {info.is_system_error}")
@@ -361,58 +706,53 @@ async def test_download(journal_id: int, db: Database, cookies: dict) -> None:
     await journal.save(db)
 
 
-async def fill_gaps(db: Database, backup_cookies: dict, min_id: int, max_id: Optional[int]) -> None:
-    # List all archived journal files
-    all_journals = list_journals_truncated(min_id, max_id)
-    logger.info("There are %s downloaded journal files", len(all_journals))
-    # Calculate how many files are missing
-    highest_id = max(all_journals, key=lambda x: x.journal_id)
-    lowest_id = min(all_journals, key=lambda x: x.journal_id)
-    total_expected = highest_id.journal_id - lowest_id.journal_id + 1
-    num_missing_files = total_expected - len(all_journals)
-    logger.info("There are %s archive files missing", num_missing_files)
-    if num_missing_files > 0:
-        # Download missing journals
-        prev_id: Optional[int] = None
-        for journal in all_journals:
-            next_id = journal.journal_id
-            # Initialise with first ID
-            if prev_id is None:
-                prev_id = next_id
-                continue
-            # Fill in missing ones
-            for missing_id in range(prev_id+1, next_id):
-                logger.info("Found missing journal ID: %s, downloading", missing_id)
-                await download_and_save(db, missing_id, backup_cookies)
-            prev_id = next_id
-        logger.info("Filled in all missing archive files")
-    # List which database entries are missing
-    all_db_journals = await db.list_journal_ids_truncated(min_id, max_id)
-    logger.info("There are %s journal entries", len(all_db_journals))
-    num_missing_entries = total_expected - len(all_db_journals)
-    logger.info("There are %s database entries missing", num_missing_entries)
-    if num_missing_entries > 0:
-        # Ingest missing journals
-        prev_id: Optional[int] = None
-        for journal_id in all_db_journals:
-            next_id = journal_id
-            # Initialise with first ID
-            if prev_id is None:
-                prev_id = next_id
-                continue
-            # Fill in missing entries
-            for missing_id in range(prev_id + 1, next_id):
-                logger.info("Found missing journal entry ID: %s, refreshing", missing_id)
-                journal = Journal(missing_id)
-                journal_info = await journal.info()
-                # Re-download any that say the journal was deleted or that are incomplete files
-                if journal_info.is_data_incomplete or journal_info.journal_deleted or journal_info.account_private:
-                    logger.info("This journal page says it was deleted, will re-download")
-                    await delete_many([journal])
-                    await download_and_save(db, missing_id, backup_cookies)
-                else:
-                    logger.info("Saving database entry")
-                    await journal.save(db)
-            # Increment prev id
-            prev_id = next_id
+async def fill_gaps(db: Database, downloader: Downloader, min_id: int, max_id: Optional[int]) -> None:
+    async with downloader:
+        await _fill_gaps(db, downloader, min_id, max_id)
+
+
+async def _fill_gap(db: Database, downloader: Downloader, missing_id: int, is_downloaded: bool) -> None:
+    try:
+        await _refresh_gap(db, downloader, missing_id, is_downloaded)
+    except DownloadFailed as e:
+        # Leave this gap for a later run, rather than stopping filling all the others
+        logger.warning("Could not fill gap for journal %s, as the download failed: %s", missing_id, e)
+
+
+async def _refresh_gap(db: Database, downloader: Downloader, missing_id: int, is_downloaded: bool) -> None:
+    journal = Journal(missing_id)
+    # Download any missing journals
+    if not is_downloaded:
+        logger.info("Found missing journal ID: %s, downloading", missing_id)
+        await download_and_save(db, downloader, missing_id)
+        return
+    logger.info("Found missing journal entry ID: %s, refreshing", missing_id)
+    journal_info = await journal.info()
+    # Re-download any that say the journal was deleted or that are incomplete files
+    if journal_info.is_data_incomplete or journal_info.journal_deleted or journal_info.account_private:
+        logger.info("This journal page says it was deleted, will re-download")
+        await delete_many([journal])
+        await download_and_save(db, downloader, missing_id)
+    else:
+        logger.info("Saving database entry")
+        await journal.save(db)
+
+
+async def _fill_gaps(db: Database, downloader: Downloader, min_id: int, max_id: Optional[int]) -> None:
+    # Have the database find the gaps between journal entries
+    gaps = [range(gap_start, gap_end + 1) async for gap_start, gap_end in db.stream_journal_id_gaps(min_id, max_id)]
+    num_missing = sum(len(gap) for gap in gaps)
+    logger.info("There are %s database entries missing", num_missing)
+    # Fill the gaps concurrently, a window at a time. Downloads are limited by the downloader, and saves are batched
+    missing_ids = itertools.chain.from_iterable(gaps)
+    num_filled = 0
+    while window := list(itertools.islice(missing_ids, FILL_GAPS_WINDOW)):
+        # Check which are already downloaded by listing their store directories, rather than checking each file
+        store_dirs = {os.path.dirname(Journal(missing_id).journal_html_filename) for missing_id in window}
+        downloaded_ids = await asyncio.to_thread(list_downloaded_journal_ids_in_dirs, store_dirs)
+        await asyncio.gather(*[
+            _fill_gap(db, downloader, missing_id, missing_id in downloaded_ids) for missing_id in window
+        ])
+        num_filled += len(window)
+        logger.info("Filled %s of %s missing journal entries", num_filled, num_missing)
     logger.info("DONE!")
@@ -1,15 +1,16 @@
+import asyncio
 import dataclasses
 import datetime
+import functools
 import json
 import logging
+import os
 import pathlib
 from typing import Optional, Type
 
-import aiofiles
-import aiofiles.os
 import prometheus_client
 
-from fa_journaliser.database import Database
+from fa_journaliser.database import Database, JournalRow
 from fa_journaliser.journal_info import JournalInfo, JournalNotFound, AccountDisabled, PendingDeletion, FASystemError
 
 logger = logging.getLogger(__name__)
@@ -20,9 +21,11 @@ total_error_counts = prometheus_client.Counter(
     "Total number of journal error pages seen when saving journals to database, by error type",
     labelnames=["error_class"],
 )
-# Initialise for all error types that are saved
-for exc_class in [None, JournalNotFound, AccountDisabled, PendingDeletion]:
-    total_error_counts.labels(error_class=exc_class.__name__ if exc_class is not None else "None")
+# Initialise and bind for all error types that are saved
+error_counts_by_type = {
+    exc_class: total_error_counts.labels(error_class=exc_class.__name__ if exc_class is not None else "None")
+    for exc_class in [None, JournalNotFound, AccountDisabled, PendingDeletion, FASystemError]
+}
 
 
 BROKEN_JOURNALS = [799264]
@@ -37,22 +40,30 @@ class Journal:
 
     async def info(self) -> JournalInfo:
         if self._info is None:
-            async with aiofiles.open(self.journal_html_filename, "rb") as f:
-                content = await f.read()
-                self._info = JournalInfo.from_content_bytes(self.journal_id, content)
+            # Read, stat, and parse the file in one worker thread call, so that importing or checking journals does not
+            # block the event loop
+            unix_mtime, self._info = await asyncio.to_thread(self._load_sync)
+            if self._archive_date is None:
+                self._archive_date = datetime.datetime.fromtimestamp(unix_mtime)
         return self._info
 
+    def _load_sync(self) -> tuple[float, JournalInfo]:
+        with open(self.journal_html_filename, "rb") as f:
+            unix_mtime = os.fstat(f.fileno()).st_mtime
+            content = f.read()
+        return unix_mtime, JournalInfo.from_content_bytes(self.journal_id, content)
+
     async def archive_date(self) -> datetime.datetime:
         if self._archive_date is None:
-            unix_mtime = await aiofiles.os.path.getmtime(self.journal_html_filename)
+            unix_mtime = await asyncio.to_thread(os.path.getmtime, self.journal_html_filename)
             self._archive_date = datetime.datetime.fromtimestamp(unix_mtime)
         return self._archive_date
 
-    @property
+    @functools.cached_property
     def journal_html_filename(self) -> pathlib.Path:
-        millions = self.journal_id // 1_000_000
-        thousands = (self.journal_id - 1_000_000 * millions) // 1_000
-        return pathlib.Path("store") / str(millions).zfill(2) / str(thousands).zfill(3) / f"{self.journal_id}.html"
+        millions, remainder = divmod(self.journal_id, 1_000_000)
+        thousands = remainder // 1_000
+        return pathlib.Path(f"store/{millions:02d}/{thousands:03d}/{self.journal_id}.html")
 
     @property
     def journal_link(self) -> str:
@@ -62,24 +73,9 @@ class Journal:
         return f"Journal(id={self.journal_id})"
 
     async def is_downloaded(self) -> bool:
-        return await aiofiles.os.path.exists(self.journal_html_filename)
-
-    @classmethod
-    def from_file_path(cls, file_path: str) -> "Journal":
-        file_name = pathlib.Path(file_path).name
-        if not file_name.endswith(".html"):
-            raise ValueError(f"Journal file {file_name} does not end with .html")
-        file_id = file_name.removesuffix(".html")
-        return Journal(
-            int(file_id),
-            None,
-        )
+        return await asyncio.to_thread(os.path.exists, self.journal_html_filename)
 
-    async def save(
-            self,
-            db: Database,
-            just_update: bool = False,
-    ) -> None:
+    async def db_row(self) -> JournalRow:
         info = await self.info()
         journal_id = self.journal_id
         is_deleted = False
@@ -123,10 +119,18 @@ class Journal:
         else:
             json_data = json.dumps(info.to_json())
             logger.info("Journal title: %s", info.title)
+        # Add to the "no errors" metric
+        error_counts_by_type[error_type].inc()
+        return journal_id, is_deleted, archive_date, error, login_used, json_data
+
+    async def save(
+            self,
+            db: Database,
+            just_update: bool = False,
+    ) -> None:
+        row = await self.db_row()
         # Save the journal to the database
         if just_update:
-            await db.update_entry(journal_id, is_deleted, archive_date, error, login_used, json_data)
+            await db.update_entry(*row)
         else:
-            await db.add_entry(journal_id, is_deleted, archive_date, error, login_used, json_data)
-        # Add to the "no errors" metric
-        total_error_counts.labels(error_class=error_type.__name__ if error_type is not None else "None").inc()
+            await db.add_entry(*row)
@@ -1,12 +1,29 @@
 import dataclasses
 import datetime
 import re
-from functools import cached_property
-from typing import Optional, TypeVar, Callable
+from typing import Optional, TypeVar, Callable, Any
 
 import dateutil.parser
 import bs4
 
+ACCOUNT_DISABLED_RE = re.compile(
+    r'User "([^"]+)" has voluntarily disabled access to their account and all of its contents.'
+)
+FA_ROOT_URL = "https://furaffinity.net"
+# Text which must appear in the raw page for each error check to match, so the parse tree is only searched if it does
+SYSTEM_ERROR_SENTINEL = "System Error"
+JOURNAL_NOT_FOUND_SENTINEL = "is not in our database"
+ACCOUNT_PRIVATE_SENTINEL = "available to registered users only"
+ACCOUNT_DISABLED_SENTINEL = "voluntarily disabled access"
+PENDING_DELETION_SENTINEL = "currently pending deletion by a request"
+# Badge blocks around a username, and which side of the name each one is
+BADGE_BLOCK_POSITIONS = {"usericon-block-before": "before", "usericon-block-after": "after"}
+# How far from the end of the page to look for the closing html tag first
+HTML_END_WINDOW = 1024
+# Format of dates on journals and comments, once any ordinal suffix is removed from the day
+FA_DATE_FORMAT = "%b %d, %Y %I:%M %p"
+ORDINAL_SUFFIX_RE = re.compile(r"(?<=\d)(?:st|nd|rd|th)(?=,)")
+
 
 class JournalNotFound(Exception):
     pass
@@ -36,6 +53,14 @@ def display_name_to_username(name: str) -> str:
     return name.lower().replace("_", "")
 
 
+def parse_fa_date(date_str: str) -> datetime.datetime:
+    # Most dates are in FA's fixed format, which strptime parses far faster than dateutil's format guessing
+    try:
+        return datetime.datetime.strptime(ORDINAL_SUFFIX_RE.sub("", date_str), FA_DATE_FORMAT)
+    except ValueError:
+        return dateutil.parser.parse(date_str)
+
+
 T = TypeVar("T")
 
 S = TypeVar("S")
@@ -47,6 +72,29 @@ def format_if_not_null(elem: Optional[T], format_func: Callable[[T], S]) -> Opti
     return format_func(elem)
 
 
+# Lock-free stand-in for functools.cached_property, named differently so it is not mistaken for the stdlib one
+class _unlocked_cached_property:
+    """
+    Caches the result of a property on the instance, like functools.cached_property, but without the lock that
+    functools holds per property before python 3.12. That lock is shared by every instance, so pages being parsed in
+    different worker threads would otherwise wait on each other.
+    """
+
+    def __init__(self, func: Callable[[Any], T]) -> None:
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.name = name
+
+    def __get__(self, instance: Any, owner: Optional[type] = None) -> Any:
+        if instance is None:
+            return self
+        value = self.func(instance)
+        instance.__dict__[self.name] = value
+        return value
+
 
 @dataclasses.dataclass
 class SiteStatusInfo:
@@ -54,35 +102,40 @@ class SiteStatusInfo:
         self.stats_elem: bs4.Tag = stats_elem
         self.footnote_elem: bs4.Tag = footnote_elem
 
-    @cached_property
+    @_unlocked_cached_property
+    def _stats_strings(self) -> list[str]:
+        # Walk the stats element once, rather than once for each stat
+        return list(self.stats_elem.stripped_strings)
+
+    @_unlocked_cached_property
     def total_online(self) -> int:
-        strings = list(self.stats_elem.stripped_strings)
+        strings = self._stats_strings
         if strings[1] != "Users online":
             raise ValueError("Total users online stat is not in the right place")
         return int(strings[0])
 
-    @cached_property
+    @_unlocked_cached_property
     def guests_online(self) -> int:
-        strings = list(self.stats_elem.stripped_strings)
+        strings = self._stats_strings
         if strings[3] != "guests":
             raise ValueError("Guests online stat is not in the right place")
         return int(strings[2].removeprefix("—").strip())
 
-    @cached_property
+    @_unlocked_cached_property
     def registered_online(self) -> int:
-        strings = list(self.stats_elem.stripped_strings)
+        strings = self._stats_strings
         if strings[5] != "registered":
             raise ValueError("Registered online stat is not in the right place")
         return int(strings[4].removeprefix(",").strip())
 
-    @cached_property
+    @_unlocked_cached_property
     def other_online(self) -> int:
-        strings = list(self.stats_elem.stripped_strings)
+        strings = self._stats_strings
         if strings[7] != "other":
             raise ValueError("Other online stat is not in the right place")
         return int(strings[6].removeprefix("and").strip())
 
-    @cached_property
+    @_unlocked_cached_property
     def server_time_at(self) -> datetime.datetime:
         footnote_str = self.footnote_elem.string.strip().removeprefix("Server Time: ")
         return dateutil.parser.parse(footnote_str)
@@ -123,24 +176,24 @@ class BadgeInfo:
             position,
             img_elem.attrs["title"],
             classes[0],
-            "https://furaffinity.net" + img_elem.attrs["src"],
+            FA_ROOT_URL + img_elem.attrs["src"],
         )
 
 
 def parse_badges_from_elem(user_elem: bs4.Tag) -> list[BadgeInfo]:
+    # Find the badge blocks before and after the name in one pass, keeping the first of each
+    block_elems = {}
+    for block_elem in user_elem.find_all(list(BADGE_BLOCK_POSITIONS)):
+        block_elems.setdefault(block_elem.name, block_elem)
+    if not block_elems:
+        return []
     badges = []
-    # Parse badges before the name
-    before_elem = user_elem.select_one("usericon-block-before")
-    if before_elem is not None:
-        badges.extend([
-            BadgeInfo.from_img(img_elem, "before") for img_elem in before_elem.select("img")
-        ])
-    # Parse badges after the name
-    after_elem = user_elem.select_one("usericon-block-after")
-    if after_elem is not None:
-        badges.extend([
-            BadgeInfo.from_img(img_elem, "after") for img_elem in after_elem.select("img")
-        ])
+    for block_name, position in BADGE_BLOCK_POSITIONS.items():
+        block_elem = block_elems.get(block_name)
+        if block_elem is not None:
+            badges.extend([
+                BadgeInfo.from_img(img_elem, position) for img_elem in block_elem.find_all("img")
+            ])
     return badges
 
 
@@ -190,18 +243,18 @@ class CommentInfo:
     def __init__(self, elem: bs4.Tag) -> None:
         self.elem = elem
 
-    @cached_property
+    @_unlocked_cached_property
     def comment_id(self) -> int:
-        comment_link = self.elem.select_one("a.comment_anchor")
+        comment_link = self.elem.find("a", class_="comment_anchor")
         comment_id_attr = comment_link.attrs["id"]
         if not comment_id_attr.startswith("cid:"):
             raise ValueError(f"Invalid comment ID: {comment_id_attr}")
         comment_id = int(comment_id_attr.removeprefix("cid:"))
         return comment_id
 
-    @cached_property
+    @_unlocked_cached_property
     def parent_id(self) -> Optional[int]:
-        anchor_elem = self.elem.select_one("comment-anchor")
+        anchor_elem = self.elem.find("comment-anchor")
         if anchor_elem is None:
             return None
         # The parent link is commented out... why?
@@ -214,7 +267,7 @@ class CommentInfo:
         # Now parse the comment as html...
         comment_str = str(comment_elem).strip()
         comment_soup = bs4.BeautifulSoup(comment_str, "html.parser")
-        parent_link = comment_soup.select_one("a.comment-parent")
+        parent_link = comment_soup.find("a", class_="comment-parent")
         if parent_link is None:
             return None
         # Now get the parent ID from the link
@@ -224,53 +277,53 @@ class CommentInfo:
         parent_id = int(parent_href.removeprefix("#cid:"))
         return parent_id
 
-    @cached_property
+    @_unlocked_cached_property
     def deletion_message(self) -> Optional[str]:
-        deleted_elem = self.elem.select_one("comment-container.deleted-comment-container")
+        deleted_elem = self.elem.find("comment-container", class_="deleted-comment-container")
         if deleted_elem is None:
             return None
-        comment_text = deleted_elem.select_one("comment-user-text")
+        comment_text = deleted_elem.find("comment-user-text")
         # Sometimes there is an extra span inside, if it's `[deleted]`
-        span_elem = comment_text.select_one("span.block__deleted_content")
+        span_elem = comment_text.find("span", class_="block__deleted_content")
         if span_elem is not None:
             return span_elem.string.strip()
         # Sometimes there is not, if it's `Comment hidden by its owner`
         return comment_text.string.strip()
 
-    @cached_property
+    @_unlocked_cached_property
     def author_avatar(self) -> Optional[str]:
-        avatar = self.elem.select_one("img.comment_useravatar")
+        avatar = self.elem.find("img", class_="comment_useravatar")
         if avatar is None:
             return None
         return "https" + avatar.attrs["src"]
 
-    @cached_property
+    @_unlocked_cached_property
     def author_username(self) -> Optional[str]:
-        avatar = self.elem.select_one("img.comment_useravatar")
+        avatar = self.elem.find("img", class_="comment_useravatar")
         if avatar is None:
             return None
         return avatar.attrs["alt"]
 
-    @cached_property
+    @_unlocked_cached_property
     def author_display_name(self) -> Optional[str]:
         display_name_elem = self.elem.select_one("comment-username strong.comment_username")
         if display_name_elem is None:
             return None
         return display_name_elem.string.strip()
 
-    @cached_property
+    @_unlocked_cached_property
     def author_badges(self) -> Optional[list[BadgeInfo]]:
-        username_elem = self.elem.select_one("comment-username")
+        username_elem = self.elem.find("comment-username")
         badges = parse_badges_from_elem(username_elem)
         badges = [b for b in badges if b.class_type != "edited-icon"]
         return badges
 
-    @cached_property
+    @_unlocked_cached_property
     def author_title(self) -> Optional[str]:
-        title_elem = self.elem.select_one("comment-title")
+        title_elem = self.elem.find("comment-title")
         return title_elem.string.strip()
 
-    @cached_property
+    @_unlocked_cached_property
     def author(self) -> Optional[CommentAuthorInfo]:
         if self.deletion_message is not None:
             return None
@@ -282,34 +335,34 @@ class CommentInfo:
             self.author_title,
         )
 
-    @cached_property
+    @_unlocked_cached_property
     def posted_at(self) -> Optional[datetime.datetime]:
         if self.deletion_message is not None:
             return None
         date_elem = self.elem.select_one("comment-date span.popup_date")
         if "ago" in date_elem.string:
-            return dateutil.parser.parse(date_elem.attrs["title"])
-        return dateutil.parser.parse(date_elem.string)
+            return parse_fa_date(date_elem.attrs["title"])
+        return parse_fa_date(date_elem.string)
 
-    @cached_property
+    @_unlocked_cached_property
     def comment_body(self) -> Optional[str]:
         body_elem = self.elem.select_one("comment-user-text .user-submitted-links")
         if body_elem is None:
             return None
         return body_elem.decode_contents().strip()
 
-    @cached_property
+    @_unlocked_cached_property
     def is_op(self) -> bool:
         op_elem = self.elem.select_one("comment-username span.comment_op_marker")
         if op_elem is None:
             return False
         return True
 
-    @cached_property
+    @_unlocked_cached_property
     def edited(self) -> bool:
         if self.deletion_message is not None:
             return False
-        username_elem = self.elem.select_one("comment-username")
+        username_elem = self.elem.find("comment-username")
         badges = parse_badges_from_elem(username_elem)
         if "edited-icon" in [b.class_type for b in badges]:
             return True
@@ -343,9 +396,9 @@ class JournalInfo:
         soup = bs4.BeautifulSoup(content, "html.parser")
         return JournalInfo(journal_id, soup, content)
 
-    @cached_property
+    @_unlocked_cached_property
     def page_title(self) -> str:
-        return self.soup.select_one("title").string
+        return self.soup.find("title").string
 
     def check_errors(self) -> None:
         if self.is_data_incomplete:
@@ -361,144 +414,160 @@ class JournalInfo:
         if self.pending_deletion_by:
             raise PendingDeletion(f"Pending deletion from {self.pending_deletion_by}")
 
-    @cached_property
+    @_unlocked_cached_property
     def is_data_incomplete(self) -> bool:
+        # The closing tag is normally right at the end, so check there before falling back to the whole page
+        if "</html>" in self.raw_content[-HTML_END_WINDOW:]:
+            return False
         return "</html>" not in self.raw_content
 
-    @cached_property
+    @_unlocked_cached_property
     def is_system_error(self) -> bool:
+        if SYSTEM_ERROR_SENTINEL not in self.raw_content:
+            return False
         return self.page_title == "System Error"
 
-    @cached_property
+    @_unlocked_cached_property
     def journal_deleted(self) -> bool:
+        if JOURNAL_NOT_FOUND_SENTINEL not in self.raw_content:
+            return False
         if self.is_system_error:
             return "The journal you are trying to find is not in our database." in self.error_message
         return False
 
-    @cached_property
-    def account_private(self) -> bool:
+    @_unlocked_cached_property
+    def notice_message(self) -> Optional[bs4.element.Tag]:
         if self.site_content is None:
+            return None
+        return self.site_content.find("section", class_="notice-message")
+
+    @_unlocked_cached_property
+    def notice_redirect_message(self) -> Optional[bs4.element.Tag]:
+        if self.notice_message is None:
+            return None
+        return self.notice_message.find(class_="redirect-message")
+
+    @_unlocked_cached_property
+    def account_private(self) -> bool:
+        if ACCOUNT_PRIVATE_SENTINEL not in self.raw_content:
             return False
-        notice_message = self.site_content.select_one("section.notice-message")
-        if notice_message is None:
-            return False
-        redirect = notice_message.select_one(".redirect-message")
+        redirect = self.notice_redirect_message
         if redirect is None:
             return False
         return "The owner of this page has elected to make it available to registered users only." in redirect.strings
 
-    @cached_property
+    @_unlocked_cached_property
     def account_disabled_username(self) -> Optional[str]:
         """
         If the page says the account is disabled, return the username of the disabled account. Otherwise return None.
         """
-        notice_message = self.site_content.select_one("section.notice-message")
-        if notice_message is None:
+        if ACCOUNT_DISABLED_SENTINEL not in self.raw_content:
             return None
-        redirect = notice_message.select_one(".redirect-message")
+        redirect = self.notice_redirect_message
         if redirect is None:
             return None
-        disabled_regex = re.compile(
-            r'User "([^"]+)" has voluntarily disabled access to their account and all of its contents.'
-        )
         for redirect_string in redirect.stripped_strings:
-            match = disabled_regex.match(redirect_string)
+            match = ACCOUNT_DISABLED_RE.match(redirect_string)
             if match is not None:
                 return match.group(1)
         return None
 
-    @cached_property
+    @_unlocked_cached_property
     def pending_deletion_by(self) -> Optional[str]:
-        notice_message = self.site_content.select_one("section.notice-message")
+        if PENDING_DELETION_SENTINEL not in self.raw_content:
+            return None
+        notice_message = self.notice_message
         if notice_message is None:
             return None
-        redirect = notice_message.select_one("p.link-override")
+        redirect = notice_message.find("p", class_="link-override")
         if redirect is None:
             return None
+        # Walk the redirect text once, rather than once per possible message
+        redirect_strings = set(redirect.stripped_strings)
         deletion_msg = "The page you are trying to reach is currently pending deletion by a request from its owner."
-        if deletion_msg in redirect.stripped_strings:
+        if deletion_msg in redirect_strings:
             return "its owner"
         deletion_msg = (
             "The page you are trying to reach is currently pending deletion by a request from the administration."
         )
-        if deletion_msg in redirect.stripped_strings:
+        if deletion_msg in redirect_strings:
             return "the administration"
         return None
 
-    @cached_property
+    @_unlocked_cached_property
     def error_message(self) -> Optional[str]:
-        error_elem = self.soup.select_one(".section-body")
+        error_elem = self.soup.find(class_="section-body")
         if error_elem:
             return " ".join(error_elem.stripped_strings)
         return None
 
-    @cached_property
+    @_unlocked_cached_property
     def login_user(self) -> Optional[str]:
-        if self.soup.select_one("form.logout-link") is None:
+        if self.soup.find("form", class_="logout-link") is None:
             return None
-        avatar = self.soup.select_one("img.loggedin_user_avatar")
+        avatar = self.soup.find("img", class_="loggedin_user_avatar")
         return avatar.attrs["alt"]
 
-    @cached_property
+    @_unlocked_cached_property
     def site_content(self) -> bs4.element.Tag:
-        return self.soup.select_one("#site-content")
+        return self.soup.find(id="site-content")
 
-    @cached_property
+    @_unlocked_cached_property
     def content(self) -> bs4.element.Tag:
-        return self.soup.select_one(".content")
+        return self.soup.find(class_="content")
 
-    @cached_property
+    @_unlocked_cached_property
     def title(self) -> str:
-        return self.content.select_one(".journal-title").string
+        return self.content.find(class_="journal-title").string
 
-    @cached_property
+    @_unlocked_cached_property
     def posted_at(self) -> datetime.datetime:
-        date_elem = self.content.select_one("span.popup_date")
+        date_elem = self.content.find("span", class_="popup_date")
         if "ago" in date_elem.string:
-            return dateutil.parser.parse(date_elem.attrs["title"])
-        return dateutil.parser.parse(date_elem.string)
+            return parse_fa_date(date_elem.attrs["title"])
+        return parse_fa_date(date_elem.string)
 
-    @cached_property
+    @_unlocked_cached_property
     def journal_header(self) -> Optional[str]:
-        header_elem = self.content.select_one(".journal-header")
+        header_elem = self.content.find(class_="journal-header")
         if header_elem is None:
             return None
         return header_elem.decode_contents().strip()
 
-    @cached_property
+    @_unlocked_cached_property
     def journal_content(self) -> str:
-        content_elem = self.content.select_one(".journal-content")
+        content_elem = self.content.find(class_="journal-content")
         return content_elem.decode_contents().strip()
 
-    @cached_property
+    @_unlocked_cached_property
     def journal_footer(self) -> Optional[str]:
-        footer_elem = self.content.select_one(".journal-footer")
+        footer_elem = self.content.find(class_="journal-footer")
         if footer_elem is None:
             return None
         return footer_elem.decode_contents().strip()
 
-    @cached_property
+    @_unlocked_cached_property
     def userpage_nav_header(self) -> Optional[bs4.element.Tag]:
         if self.site_content is None:
             return None
-        return self.site_content.select_one("userpage-nav-header")
+        return self.site_content.find("userpage-nav-header")
 
-    @cached_property
+    @_unlocked_cached_property
     def author_display_name(self) -> Optional[str]:
         if self.userpage_nav_header is None:
             return None
-        username_elem = self.userpage_nav_header.select_one("username")
+        username_elem = self.userpage_nav_header.find("username")
         display_name = "".join(username_elem.stripped_strings)
         prefix = self.author_status_prefix
         if prefix is not None:
             display_name = display_name.removeprefix(prefix)
         return display_name
 
-    @cached_property
+    @_unlocked_cached_property
     def author_status_prefix(self) -> Optional[str]:
         if self.userpage_nav_header is None:
             return None
-        username_elem = self.userpage_nav_header.select_one("username")
+        username_elem = self.userpage_nav_header.find("username")
         display_name = "".join(username_elem.stripped_strings)
         potential_prefix = display_name[0]
         username = self.author_username
@@ -519,7 +588,7 @@ class JournalInfo:
             f"it should be {potential_username}"
         )
 
-    @cached_property
+    @_unlocked_cached_property
     def author_status_prefix_meaning(self) -> Optional[str]:
         return {
             None: None,
@@ -530,18 +599,18 @@ class JournalInfo:
             "-": "Banned",
         }[self.author_status_prefix]
 
-    @cached_property
+    @_unlocked_cached_property
     def author_badges(self) -> Optional[list[BadgeInfo]]:
         if self.userpage_nav_header is None:
             return None
-        username_elem = self.userpage_nav_header.select_one("username")
+        username_elem = self.userpage_nav_header.find("username")
         return parse_badges_from_elem(username_elem)
 
-    @cached_property
+    @_unlocked_cached_property
     def _author_user_title_elems(self) -> Optional[list[bs4.PageElement]]:
         if self.userpage_nav_header is None:
             return None
-        user_title_elem = self.userpage_nav_header.select_one(".user-title")
+        user_title_elem = self.userpage_nav_header.find(class_="user-title")
         if user_title_elem is None:
             return None
         title_elems = user_title_elem.contents
@@ -549,7 +618,7 @@ class JournalInfo:
             raise ValueError(f"Could not parse user-title, element does not have 3 children: {title_elems}")
         return title_elems
 
-    @cached_property
+    @_unlocked_cached_property
     def author_title(self) -> Optional[str]:
         title_elems = self._author_user_title_elems
         if title_elems is None:
@@ -557,7 +626,7 @@ class JournalInfo:
         user_title = str(title_elems[0]).strip().removesuffix("|").rstrip()
         return user_title
 
-    @cached_property
+    @_unlocked_cached_property
     def author_registered_at(self) -> Optional[datetime.datetime]:
         title_elems = self._author_user_title_elems
         if title_elems is None:
@@ -565,13 +634,13 @@ class JournalInfo:
         registered_str = str(title_elems[-1]).strip()
         return dateutil.parser.parse(registered_str)
 
-    @cached_property
+    @_unlocked_cached_property
     def author_username(self) -> Optional[str]:
         if self.userpage_nav_header is None:
             return None
         return self.userpage_nav_header.select_one("userpage-nav-avatar img").attrs["alt"]
 
-    @cached_property
+    @_unlocked_cached_property
     def author_avatar(self) -> Optional[str]:
         if self.userpage_nav_header is None:
             return None
@@ -580,7 +649,7 @@ class JournalInfo:
             avatar_url = f"https{avatar_url}"
         return avatar_url
 
-    @cached_property
+    @_unlocked_cached_property
     def author(self) -> Optional[AuthorInfo]:
         if self.userpage_nav_header is None:
             return None
@@ -595,11 +664,11 @@ class JournalInfo:
             self.author_registered_at,
         )
 
-    @cached_property
+    @_unlocked_cached_property
     def comments_disabled(self) -> Optional[bool]:
         if self.content is None:
             return False
-        response_box = self.content.select_one("#responsebox")
+        response_box = self.content.find(id="responsebox")
         if response_box is None:
             return False
         response_string = response_box.string
@@ -607,23 +676,23 @@ class JournalInfo:
             return False
         return response_string.strip() == "Comment posting has been disabled by the journal owner."
 
-    @cached_property
+    @_unlocked_cached_property
     def comments(self) -> Optional[list[CommentInfo]]:
-        comments_elem = self.soup.select_one("#comments-journal")
+        comments_elem = self.soup.find(id="comments-journal")
         if comments_elem is None:
             return None
         comments: list[CommentInfo] = []
-        for comment_elem in comments_elem.select(".comment_container"):
+        for comment_elem in comments_elem.find_all(class_="comment_container"):
             comments.append(CommentInfo(comment_elem))
         return comments
 
-    @cached_property
+    @_unlocked_cached_property
     def num_comments(self) -> int:
         if self.comments is None:
             return 0
         return len(self.comments)
 
-    @cached_property
+    @_unlocked_cached_property
     def latest_comment_posted_at(self) -> Optional[datetime.datetime]:
         latest_datetime = None
         if self.comments is not None:
@@ -637,10 +706,10 @@ class JournalInfo:
                 latest_datetime = max(latest_datetime, comment_date)
         return latest_datetime
 
-    @cached_property
+    @_unlocked_cached_property
     def site_status(self) -> Optional[SiteStatusInfo]:
-        stats_elem = self.soup.select_one(".online-stats")
-        footnote_elem = self.soup.select_one(".footnote")
+        stats_elem = self.soup.find(class_="online-stats")
+        footnote_elem = self.soup.find(class_="footnote")
         if stats_elem is None or footnote_elem is None:
             return None
         return SiteStatusInfo(stats_elem, footnote_elem)
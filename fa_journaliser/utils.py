@@ -1,8 +1,9 @@
 import asyncio
-import glob
+import bisect
 import logging
+import os
 from collections import Counter
-from typing import Callable, TypeVar, Optional, Coroutine
+from typing import Optional, Coroutine, Iterator, Iterable
 
 import aiofiles.os
 import prometheus_client
@@ -22,23 +23,45 @@ total_journal_files = prometheus_client.Gauge(
 )
 
 
+def _scan_journal_ids(dir_path: str) -> Iterator[int]:
+    with os.scandir(dir_path) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir():
+                yield from _scan_journal_ids(entry.path)
+            elif entry.name.endswith(".html"):
+                yield int(entry.name.removesuffix(".html"))
+
+
+def list_downloaded_journal_ids() -> list[int]:
+    # Walk the store with scandir, which gets file types from the directory listing without a stat per file
+    if not os.path.isdir("store"):
+        return []
+    return sorted(_scan_journal_ids("store"))
+
+
+def list_downloaded_journal_ids_in_dirs(dir_paths: Iterable[str]) -> set[int]:
+    # Listing each store directory once is far fewer syscalls than checking each journal file exists in turn
+    journal_ids = set()
+    for dir_path in dir_paths:
+        if os.path.isdir(dir_path):
+            journal_ids.update(_scan_journal_ids(dir_path))
+    return journal_ids
+
+
 def list_downloaded_journals() -> list[Journal]:
-    file_paths = glob.glob("store/**/*.html", recursive=True)
-    journals = [
-        Journal.from_file_path(file_path) for file_path in file_paths
-    ]
-    return sorted(journals, key=lambda journal: journal.journal_id)
+    return [Journal(journal_id) for journal_id in list_downloaded_journal_ids()]
 
 
-def list_journals_truncated(min_id: int, max_id: Optional[int]) -> list[Journal]:
+def list_journal_ids_truncated(min_id: int, max_id: Optional[int]) -> list[int]:
     # List all current journals
-    all_journals = list_downloaded_journals()
-    total_journal_files.set(len(all_journals))
-    # Truncate the set of journals to min and max
-    return [
-        j for j in all_journals
-        if j.journal_id >= min_id and (max_id is None or j.journal_id <= max_id)
-    ]
+    journal_ids = list_downloaded_journal_ids()
+    total_journal_files.set(len(journal_ids))
+    # Truncate the sorted IDs to min and max
+    start = bisect.bisect_left(journal_ids, min_id)
+    end = len(journal_ids) if max_id is None else bisect.bisect_right(journal_ids, max_id)
+    return journal_ids[start:end]
 
 
 async def check_downloads() -> None:
@@ -88,6 +111,7 @@ async def _import_downloaded_journal(db: Database, journal: Journal, just_update
 async def import_downloads(
         db: Database,
         repopulate_path: Optional[str],
+        index_repopulate_path: bool,
         from_file: Optional[str],
         min_id: int,
         max_id: Optional[int],
@@ -99,12 +123,18 @@ async def import_downloads(
             journal_ids = [int(line) for line in f.read().split("\n") if line]
     else:
         # List all journal IDs
-        journal_ids = [j.journal_id for j in list_journals_truncated(min_id, max_id)]
+        journal_ids = list_journal_ids_truncated(min_id, max_id)
     logger.info("Total of %s journal files archived", len(journal_ids))
     # If a repopulate path is given, filter down that list
     if repopulate_path:
-        filter_ids = await db.list_ids_where_path_is_null(repopulate_path)
-        journal_ids = [j for j in journal_ids if j in filter_ids]
+        if index_repopulate_path:
+            logger.info("Creating database index for json path %s", repopulate_path)
+            await db.create_json_path_index(repopulate_path)
+        archived_ids = set(journal_ids)
+        journal_ids = [
+            journal_id async for journal_id in db.stream_ids_where_path_is_null(repopulate_path)
+            if journal_id in archived_ids
+        ]
         logger.info("Filtered down to %s journals to update", len(journal_ids))
     # Set up a TaskWorker to process journals
     worker = TaskWorker(concurrent_tasks, [
@@ -139,16 +169,6 @@ class TaskWorker:
                 raise e
 
 
-T = TypeVar("T")
-
-
-def split_list(seq: list[T], condition: Callable[[T], bool]) -> dict[bool, list[T]]:
-    result = {True: [], False: []}
-    for item in seq:
-        result[condition(item)].append(item)
-    return result
-
-
 def _peak_time_active(currently_active: bool, journal_infos: list[JournalInfo], peak_cutoff: int) -> bool:
     registered_counts = [j.site_status.registered_online for j in journal_infos if j.site_status is not None]
     if not registered_counts:
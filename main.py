@@ -11,9 +11,9 @@ import prometheus_client
 from prometheus_client import start_http_server
 
 from fa_journaliser.database import Database
-from fa_journaliser.download import run_download, fill_gaps, test_download, work_forwards, \
-    download_if_not_exists, work_backwards
-from fa_journaliser.utils import check_downloads, import_downloads, list_journals_truncated
+from fa_journaliser.download import run_download, fill_gaps, test_download, run_work_forwards, \
+    run_work_backwards, Downloader, MAX_CONCURRENT_DOWNLOADS
+from fa_journaliser.utils import check_downloads, import_downloads
 from fa_journaliser.prom import get_prometheus_port
 
 logger = logging.getLogger(__name__)
@@ -48,6 +48,15 @@ def setup_logging() -> None:
     aiohttp_logger.propagate = False
 
 
+def build_downloader(conf: dict) -> Downloader:
+    return Downloader(
+        conf["fa_cookies"],
+        max_concurrent_downloads=conf.get("max_concurrent_downloads", MAX_CONCURRENT_DOWNLOADS),
+        max_retries=conf.get("max_download_retries"),
+        login_first_ratio=conf.get("login_first_private_ratio"),
+    )
+
+
 class AppContextObj(TypedDict):
     db: Database
     conf: dict
@@ -87,8 +96,8 @@ def main(ctx: AppContext) -> None:
 def cmd_test_download(ctx: AppContext, journal_id: int) -> None:
     ctx.ensure_object(dict)
     db = ctx.obj["db"]
-    cookies = ctx.obj["conf"]["fa_cookies"]
-    asyncio.run(test_download(journal_id, db, cookies))
+    downloader = build_downloader(ctx.obj["conf"])
+    asyncio.run(test_download(journal_id, db, downloader))
 
 
 @main.command("check-downloads", help="Checks through all downloaded journals, to ensure they can be correctly parsed")
@@ -110,6 +119,12 @@ def cmd_check_downloads(ctx: AppContext) -> None:
          "archive file",
     default=None,
 )
+@click.option(
+    "--index-repopulate-path",
+    is_flag=True,
+    help="If set, create a database index on the --repopulate-path json path before searching it. The index is kept, "
+         "which speeds up later repopulates of the same path, but slows down every later database write",
+)
 @click.option(
     "--from-file",
     help="If provided, read the specified file for a list of journal IDs to import. Helpful if an external query has "
@@ -128,6 +143,7 @@ def cmd_check_downloads(ctx: AppContext) -> None:
 def cmd_import_downloads(
         ctx: AppContext,
         repopulate_path: Optional[str],
+        index_repopulate_path: bool,
         from_file: Optional[str],
         min_journal: int,
         max_journal: Optional[int],
@@ -140,6 +156,7 @@ def cmd_import_downloads(
     asyncio.run(import_downloads(
         db,
         repopulate_path,
+        index_repopulate_path,
         from_file,
         min_journal,
         max_journal,
@@ -164,13 +181,15 @@ def cmd_import_downloads(
 @click.option(
     "--batch-size",
     type=int,
-    help="How many downloads to do at once in both directions",
+    help="The most downloads to do at once in both directions. Working forwards uses smaller batches while there "
+         "are few new journals",
     default=DEFAULT_BATCH_SIZE,
 )
 @click.option(
     "--forward-batch-size",
     type=int,
-    help="How many downloads to do at once working forwards",
+    help="The most downloads to do at once working forwards. Smaller batches are used while there are few new "
+         "journals",
     default=None,
 )
 @click.option(
@@ -200,8 +219,8 @@ def cmd_import_downloads(
 @click.option(
     "--forward-empty-batch-sleep",
     type=int,
-    help="How many seconds to sleep before fetching the next batch of new journals, when working forwards, if the last "
-         "batch was empty",
+    help="The longest to sleep, in seconds, before fetching the next batch of new journals when working forwards. "
+         "After an empty batch, the sleep starts at 2 seconds and doubles with each further empty batch, up to this",
     default=DEFAULT_EMPTY_BATCH_SLEEP,
 )
 @click.option(
@@ -227,7 +246,7 @@ def cmd_run_download(
 ) -> None:
     ctx.ensure_object(dict)
     db = ctx.obj["db"]
-    cookies = ctx.obj["conf"]["fa_cookies"]
+    downloader = build_downloader(ctx.obj["conf"])
     # Setup batch sizes
     if forward_batch_size is None:
         forward_batch_size = batch_size
@@ -240,7 +259,7 @@ def cmd_run_download(
     # Run downloader
     asyncio.run(run_download(
         db,
-        cookies,
+        downloader,
         start_id=start_journal,
         min_id=min_journal,
         max_id=max_journal,
@@ -265,11 +284,17 @@ def cmd_run_download(
     default=START_JOURNAL,
 )
 @click.option("--max-journal", "--max", type=int, help="The ID of the newest journal to download", default=None)
-@click.option("--batch-size", type=int, help="How many downloads to do at once", default=DEFAULT_BATCH_SIZE)
+@click.option(
+    "--batch-size",
+    type=int,
+    help="The most downloads to do at once. Smaller batches are used while there are few new journals",
+    default=DEFAULT_BATCH_SIZE,
+)
 @click.option(
     "--empty-batch-sleep",
     type=int,
-    help="How many seconds to sleep before fetching the next batch of new journals, if the last batch was empty",
+    help="The longest to sleep, in seconds, before fetching the next batch of new journals. After an empty batch, the "
+         "sleep starts at 2 seconds and doubles with each further empty batch, up to this",
     default=DEFAULT_EMPTY_BATCH_SLEEP
 )
 @click.option(
@@ -296,19 +321,12 @@ def cmd_work_forwards(
 ) -> None:
     ctx.ensure_object(dict)
     db = ctx.obj["db"]
-    cookies = ctx.obj["conf"]["fa_cookies"]
-    # List relevant journals
-    journals = list_journals_truncated(start_journal, max_journal)
-    if not journals:
-        # Fetch start journal if none exists
-        journals.append(asyncio.run(download_if_not_exists(db, start_journal, cookies)))
-    # Get the start point of these journals
-    journal = max(journals, key=lambda x: x.journal_id)
+    downloader = build_downloader(ctx.obj["conf"])
     # Start working forwards
-    asyncio.run(work_forwards(
+    asyncio.run(run_work_forwards(
         db,
-        journal,
-        cookies,
+        downloader,
+        start_journal,
         max_id=max_journal,
         batch_size=batch_size,
         peak_sleep=peak_sleep,
@@ -353,19 +371,12 @@ def cmd_work_backwards(
 ) -> None:
     ctx.ensure_object(dict)
     db = ctx.obj["db"]
-    cookies = ctx.obj["conf"]["fa_cookies"]
-    # List relevant journals
-    journals = list_journals_truncated(min_journal, start_journal)
-    if not journals:
-        # Fetch start journal if none exists
-        journals.append(asyncio.run(download_if_not_exists(db, start_journal, cookies)))
-    # Get the start point of these journals
-    journal = min(journals, key=lambda x: x.journal_id)
+    downloader = build_downloader(ctx.obj["conf"])
     # Start working backwards
-    asyncio.run(work_backwards(
+    asyncio.run(run_work_backwards(
         db,
-        journal,
-        cookies,
+        downloader,
+        start_journal,
         min_id=min_journal,
         batch_size=batch_size,
         peak_sleep=peak_sleep,
@@ -375,9 +386,9 @@ def cmd_work_backwards(
 
 @main.command(
     "fill-gaps",
-    help="Checks through the list of all downloaded journals, and fills in any missing journals in that dataset which "
-         "may have been deleted or lost. Checks journals missing database entries also, redownloading any which say "
-         "they were deleted.",
+    help="Checks through the list of all journal database entries, and fills in any missing journals in that dataset "
+         "which may have been deleted or lost. Missing entries with an archive file are re-imported, redownloading any "
+         "which say they were deleted.",
 )
 @click.option("--min-journal", "--min", type=int, help="The ID of the oldest journal to check", default=0)
 @click.option("--max-journal", "--min", type=int, help="The ID of the newest journal to check", default=None)
@@ -385,9 +396,9 @@ def cmd_work_backwards(
 def cmd_fill_gaps(ctx: AppContext, min_journal: 0, max_journal: Optional[int]) -> None:
     ctx.ensure_object(dict)
     db = ctx.obj["db"]
-    cookies = ctx.obj["conf"]["fa_cookies"]
+    downloader = build_downloader(ctx.obj["conf"])
     # Fill gaps
-    asyncio.run(fill_gaps(db, cookies, min_journal, max_journal))
+    asyncio.run(fill_gaps(db, downloader, min_journal, max_journal))
 
 
 if __name__ == "__main__":